@@ -0,0 +1,365 @@
+import datetime
+import functools
+import hashlib
+import inspect
+import json
+import random
+import subprocess
+import sys
+import time
+import types
+
+# Stages simulated by the fakes. Latencies are in seconds and failure rates
+# are probabilities between 0 and 1; both default to zero so that a run
+# measures only the code in this repository.
+FAKE_STAGES = [
+    "azure_login",
+    "acr_login",
+    "aks_login",
+    "docker_build",
+    "docker_push",
+    "create_secrets",
+    "execute_job",
+    "wait_for_pod",
+    "get_logs",
+]
+
+
+class StageRecorder:
+    """
+    Record the duration of each call to a pipeline stage.
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    def record(self, stage, seconds):
+        """
+        Record a single duration for a stage.
+
+        Parameters:
+        - stage (str): The name of the stage.
+        - seconds (float): The time the stage took.
+        """
+        self.durations.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, func):
+        """
+        Wrap a function so that each call is timed as the given stage.
+
+        Parameters:
+        - stage (str): The name of the stage.
+        - func (callable): The function to wrap, either sync or async.
+        """
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+
+class FakeSettings:
+    """
+    Latency, failure rate and output settings shared by the fakes.
+
+    Parameters:
+    - latency (dict): Seconds to block for, keyed by stage name.
+    - failure_rate (dict): Probability of raising an error, keyed by stage name.
+    - response (str): The pod log output returned by the fake job.
+    - seed (int): The seed for the failure random number generator (default is unseeded).
+    """
+
+    def __init__(self, latency=None, failure_rate=None, response="£82m", seed=None):
+        self.latency = latency or {}
+        self.failure_rate = failure_rate or {}
+        self.response = response
+        self.random = random.Random(seed)
+
+    def simulate(self, stage):
+        """
+        Block for the stage latency and raise an error at the stage failure rate.
+
+        The real SDK calls are blocking, so the fakes block with time.sleep to
+        keep the same effect on the event loop.
+
+        Parameters:
+        - stage (str): The name of the stage.
+        """
+        latency = self.latency.get(stage, 0)
+        if latency:
+            time.sleep(latency)
+        if self.fails(stage):
+            raise RuntimeError(f"Simulated failure in stage '{stage}'")
+
+    def fails(self, stage):
+        """
+        Decide at the stage failure rate whether a call to the stage fails.
+
+        Parameters:
+        - stage (str): The name of the stage.
+        """
+        return self.random.random() < self.failure_rate.get(stage, 0)
+
+
+class FakeModel:
+    """
+    A stand-in for the Kubernetes client models, which keeps its keyword arguments as attributes.
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def create_subprocess_module(settings):
+    """
+    Create a stand-in for the subprocess module that fakes the Azure CLI commands.
+
+    Parameters:
+    - settings (FakeSettings): The settings shared by the fakes.
+    """
+    module = types.ModuleType("subprocess")
+    module.__dict__.update(vars(subprocess))
+
+    def run(command, check=False, **kwargs):
+        if command[:2] == ["az", "login"]:
+            stage, stdout = "azure_login", ""
+        elif command[:3] == ["az", "acr", "login"]:
+            stage, stdout = "acr_login", json.dumps({"accessToken": "fake-access-token"})
+        elif command[:3] == ["az", "aks", "get-credentials"]:
+            stage, stdout = "aks_login", ""
+        else:
+            raise ValueError(f"Unexpected command in benchmark: {command[:3]}")
+
+        try:
+            settings.simulate(stage)
+        except RuntimeError as e:
+            if check:
+                raise subprocess.CalledProcessError(1, command, output="", stderr=str(e))
+            return subprocess.CompletedProcess(command, 1, stdout="", stderr=str(e))
+        return subprocess.CompletedProcess(command, 0, stdout=stdout, stderr="")
+
+    module.run = run
+    return module
+
+
+def create_identity_module(settings):
+    """
+    Create a stand-in for the azure.identity module.
+
+    Parameters:
+    - settings (FakeSettings): The settings shared by the fakes.
+    """
+    module = types.ModuleType("azure.identity")
+
+    class DefaultAzureCredential:
+        def get_token(self, *scopes):
+            settings.simulate("azure_login")
+            return types.SimpleNamespace(token="fake-token", expires_on=int(time.time()) + 3600)
+
+    module.DefaultAzureCredential = DefaultAzureCredential
+    return module
+
+
+def create_docker_module(settings):
+    """
+    Create a stand-in for the Docker SDK.
+
+    Like the real SDK, a failed push is reported in the push output rather
+    than raised, and pushed images have a digest in their RepoDigests.
+
+    Parameters:
+    - settings (FakeSettings): The settings shared by the fakes.
+    """
+    module = types.ModuleType("docker")
+    module.errors = types.SimpleNamespace(ImageNotFound=type("ImageNotFound", (Exception,), {}))
+    pushed = set()
+
+    class Images:
+        def build(self, path, tag, **kwargs):
+            settings.simulate("docker_build")
+            return types.SimpleNamespace(tags=[tag]), iter([])
+
+        def push(self, repository, tag, stream=False, decode=False, **kwargs):
+            yield {"status": f"The push refers to repository [{repository}]"}
+            try:
+                settings.simulate("docker_push")
+            except RuntimeError as e:
+                yield {"errorDetail": {"message": str(e)}, "error": str(e)}
+                return
+            pushed.add(f"{repository}:{tag}")
+            yield {"status": f"{tag}: digest: sha256:{get_digest(repository, tag)} size: 1234"}
+
+        def get(self, name):
+            repository, _, tag = name.rpartition(":")
+            if name not in pushed:
+                raise module.errors.ImageNotFound(f"No such image: {name}")
+            return types.SimpleNamespace(attrs={"RepoDigests": [f"{repository}@sha256:{get_digest(repository, tag)}"]})
+
+    class DockerClient:
+        def __init__(self):
+            self.images = Images()
+
+        def login(self, username, password, registry, **kwargs):
+            return {"Status": "Login Succeeded"}
+
+    def get_digest(repository, tag):
+        return hashlib.sha256(f"{repository}:{tag}".encode()).hexdigest()
+
+    module.from_env = DockerClient
+    return module
+
+
+def create_kubernetes_modules(settings):
+    """
+    Create stand-ins for the Kubernetes client package and its client, rest and config modules.
+
+    Jobs run on a fake cluster: a pod is Running until the wait_for_pod latency
+    has passed, then Succeeded with a termination message giving its resource
+    usage, or Failed at the wait_for_pod failure rate.
+
+    Parameters:
+    - settings (FakeSettings): The settings shared by the fakes.
+    """
+    package = types.ModuleType("kubernetes")
+    client = types.ModuleType("kubernetes.client")
+    rest = types.ModuleType("kubernetes.client.rest")
+    config = types.ModuleType("kubernetes.config")
+    secrets = {}
+    jobs = {}
+    models = {}
+
+    class ApiException(Exception):
+        def __init__(self, status=None, reason=None):
+            super().__init__(f"({status}) Reason: {reason}")
+            self.status = status
+            self.reason = reason
+
+    def get_model(name):
+        # Any client.V1* name is a model class, as in the real client
+        if not name.startswith("V1"):
+            raise AttributeError(f"module 'kubernetes.client' has no attribute '{name}'")
+        return models.setdefault(name, type(name, (FakeModel,), {}))
+
+    def create_pod(job_name):
+        job = jobs[job_name]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        terminated = None
+        if now < job["finished_at"]:
+            phase = "Running"
+        elif job["failed"]:
+            phase = "Failed"
+        else:
+            phase = "Succeeded"
+            terminated = get_model("V1ContainerStateTerminated")(
+                exit_code=0,
+                started_at=job["started_at"],
+                finished_at=job["finished_at"],
+                message=json.dumps({"memory_bytes": 64 * 1024 * 1024, "cpu_usec": 500000}),
+            )
+        return get_model("V1Pod")(
+            metadata=get_model("V1ObjectMeta")(name=f"{job_name}-fake"),
+            status=get_model("V1PodStatus")(
+                phase=phase,
+                reason=None,
+                container_statuses=[
+                    get_model("V1ContainerStatus")(state=get_model("V1ContainerState")(terminated=terminated))
+                ],
+            ),
+        )
+
+    class CoreV1Api:
+        def read_namespaced_secret(self, name, namespace):
+            settings.simulate("create_secrets")
+            if (namespace, name) not in secrets:
+                raise ApiException(status=404, reason="Not Found")
+            return secrets[(namespace, name)]
+
+        def replace_namespaced_secret(self, name, namespace, body):
+            secrets[(namespace, name)] = body
+
+        def create_namespaced_secret(self, namespace, body):
+            secrets[(namespace, body.metadata.name)] = body
+
+        def list_namespaced_pod(self, namespace, label_selector):
+            job_name = label_selector.partition("job-name=")[2]
+            items = [create_pod(job_name)] if job_name in jobs else []
+            return get_model("V1PodList")(items=items)
+
+        def read_namespaced_pod_log(self, name, namespace):
+            settings.simulate("get_logs")
+            return f"{settings.response}\n"
+
+    class BatchV1Api:
+        def create_namespaced_job(self, namespace, body):
+            settings.simulate("execute_job")
+            started_at = datetime.datetime.now(datetime.timezone.utc)
+            jobs[body.metadata.name] = {
+                "started_at": started_at,
+                "finished_at": started_at + datetime.timedelta(seconds=settings.latency.get("wait_for_pod", 0)),
+                "failed": settings.fails("wait_for_pod"),
+            }
+            return body
+
+    rest.ApiException = ApiException
+    client.__getattr__ = get_model
+    client.CoreV1Api = CoreV1Api
+    client.BatchV1Api = BatchV1Api
+    client.rest = rest
+    config.load_kube_config = lambda *args, **kwargs: None
+    package.client = client
+    package.config = config
+    return {
+        "kubernetes": package,
+        "kubernetes.client": client,
+        "kubernetes.client.rest": rest,
+        "kubernetes.config": config,
+    }
+
+
+def install(settings):
+    """
+    Install the fakes in place of the Azure CLI and the Azure identity, Docker and Kubernetes SDKs.
+
+    Must be called before main is imported. The fakes replace the SDKs where
+    the utils wrappers call them, so the wrappers run for real, including the
+    shared store caches and locks, the pod template and the usage parsing.
+    The SDKs do not need to be installed.
+
+    Parameters:
+    - settings (FakeSettings): The settings shared by the fakes.
+    """
+    identity = create_identity_module(settings)
+    try:
+        import azure.identity  # noqa: F401
+    except ImportError:
+        # Let utils.azure import without the SDK; azure-ai-evaluation needs the real one when installed
+        azure = sys.modules.setdefault("azure", types.ModuleType("azure"))
+        azure.__path__ = getattr(azure, "__path__", [])
+        azure.identity = sys.modules["azure.identity"] = identity
+    sys.modules["docker"] = create_docker_module(settings)
+    sys.modules.update(create_kubernetes_modules(settings))
+
+    # The Azure CLI and credentials are only replaced where the wrappers use them
+    from utils import azure as azure_utils
+    from utils import kubernetes as kubernetes_utils
+
+    fake_subprocess = create_subprocess_module(settings)
+    azure_utils.identity = identity
+    azure_utils.subprocess = fake_subprocess
+    kubernetes_utils.subprocess = fake_subprocess
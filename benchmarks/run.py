@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fakes
+import httpx
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_PATH = os.path.join(ROOT_PATH, "src")
+SAMPLES_PATH = os.path.join(ROOT_PATH, "resources", "samples")
+
+# Settings pinned before main is imported, so that a developer's .env cannot
+# change a run (load_dotenv does not override variables that are already set)
+BENCHMARK_ENVIRONMENT = {
+    "RUNTIME_PROFILES_FILE": "",
+    "WORKERS": "1",
+    "RESULT_CACHE_SECONDS": "0",
+    "STATE_STORE_PATH": "state.db",
+}
+
+# Stages of the real code that are timed alongside the fakes
+MEASURED_STAGES = {
+    "file.delete_path": ("file", "delete_path"),
+    "file.hash_files": ("file", "hash_files"),
+    "file.write_file": ("file", "write_file"),
+    "file.copy_file": ("file", "copy_file"),
+    "notebook.convert_notebook_to_script": ("notebook", "convert_notebook_to_script"),
+    "evaluation.evaluate": ("evaluation", "evaluate"),
+    "azure.azure_login": ("azure", "azure_login"),
+}
+
+# Methods of the wrappers that are timed as stages
+MEASURED_METHODS = {
+    "docker.build": ("docker_mod", "DockerWrapper", "build"),
+    "docker.push": ("docker_mod", "DockerWrapper", "push"),
+    "kubernetes.authenticate": ("kubernetes", "KubernetesWrapper", "authenticate"),
+    "kubernetes.create_secrets": ("kubernetes", "KubernetesWrapper", "create_secrets"),
+    "kubernetes.execute_job": ("kubernetes", "KubernetesWrapper", "execute_job"),
+    "kubernetes.wait_for_pod_completion": ("kubernetes", "KubernetesWrapper", "wait_for_pod_completion"),
+    "kubernetes.get_logs": ("kubernetes", "KubernetesWrapper", "get_logs"),
+}
+
+
+def parse_stage_values(values, option):
+    """
+    Parse repeated STAGE=VALUE options into a dict.
+
+    Parameters:
+    - values (list): The raw option values.
+    - option (str): The option name, used in error messages.
+    """
+    parsed = {}
+    for value in values or []:
+        stage, _, number = value.partition("=")
+        if stage not in fakes.FAKE_STAGES or not number:
+            raise SystemExit(
+                f"Invalid {option} '{value}'. Use STAGE=VALUE with a stage from: {', '.join(fakes.FAKE_STAGES)}"
+            )
+        parsed[stage] = float(number)
+    return parsed
+
+
+def percentile(values, percent):
+    """
+    Calculate a percentile using the nearest-rank method.
+
+    Parameters:
+    - values (list): The sample values.
+    - percent (float): The percentile to calculate, between 0 and 100.
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarise(durations):
+    """
+    Summarise the durations of each stage as latency percentiles in milliseconds.
+
+    Parameters:
+    - durations (dict): Lists of durations in seconds, keyed by stage name.
+    """
+    summary = {}
+    for stage, values in sorted(durations.items()):
+        summary[stage] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+    return summary
+
+
+def create_workspace():
+    """
+    Create a temporary working directory laid out like the repository root.
+
+    The endpoint writes to a relative execution directory and copies the
+    boilerplate from src/boilerplate, so the benchmark runs from a copy to
+    keep the repository clean.
+    """
+    workspace = tempfile.mkdtemp(prefix="evaluation-runtime-bench-")
+    shutil.copytree(
+        os.path.join(SOURCE_PATH, "boilerplate"),
+        os.path.join(workspace, "src", "boilerplate"),
+    )
+    return workspace
+
+
+def load_app(settings, recorder):
+    """
+    Pin the environment, install the fakes, import the FastAPI app and wrap its stages for timing.
+
+    Parameters:
+    - settings (fakes.FakeSettings): The settings shared by the fakes.
+    - recorder (fakes.StageRecorder): The recorder for stage durations.
+    """
+    sys.path.insert(0, SOURCE_PATH)
+    os.environ.update(BENCHMARK_ENVIRONMENT)
+    fakes.install(settings)
+
+    import main
+
+    # Keep the per-request logging out of the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for stage, (module_name, function_name) in MEASURED_STAGES.items():
+        module = getattr(main, module_name)
+        setattr(module, function_name, recorder.wrap(stage, getattr(module, function_name)))
+
+    for stage, (module_name, class_name, method_name) in MEASURED_METHODS.items():
+        cls = getattr(getattr(main, module_name), class_name)
+        setattr(cls, method_name, recorder.wrap(stage, getattr(cls, method_name)))
+
+    return main.app
+
+
+def make_unique(script, filename, index):
+    """
+    Add a comment naming the request to a script, so that its image misses the image cache.
+
+    Parameters:
+    - script (bytes): The script or notebook to upload.
+    - filename (str): The name of the script, used to detect notebooks.
+    - index (int): The index of the request.
+    """
+    if filename.endswith(".ipynb"):
+        notebook = json.loads(script)
+        notebook["cells"].append(
+            {"cell_type": "markdown", "metadata": {}, "source": [f"Benchmark request {index}"]}
+        )
+        return json.dumps(notebook).encode("utf-8")
+    return script + f"\n# Benchmark request {index}\n".encode("utf-8")
+
+
+async def send_request(client, args, index, scheduled, script, extraction, recorder, results):
+    """
+    Send a single evaluation request and record its outcome.
+
+    The total latency is measured from the time the request was scheduled to
+    start, not the time it was sent. Otherwise a request held back by a busy
+    event loop would leave its wait out of the latency (coordinated omission).
+
+    Parameters:
+    - client (httpx.AsyncClient): The client bound to the app.
+    - args (argparse.Namespace): The benchmark options.
+    - index (int): The index of the request.
+    - scheduled (float): The time.perf_counter value at which the request was scheduled to start.
+    - script (bytes): The script or notebook to upload.
+    - extraction (bytes): The extraction file to upload.
+    - recorder (fakes.StageRecorder): The recorder for stage durations.
+    - results (list): The list to append the response status code to.
+    """
+    if args.unique_uploads:
+        script = make_unique(script, args.script, index)
+
+    response = await client.post(
+        "/",
+        data={
+            "ground_truth": args.ground_truth,
+            "evaluators": args.evaluators,
+            "profile": args.profile,
+        },
+        files={
+            "script": (os.path.basename(args.script), script),
+            "extraction": (os.path.basename(args.extraction), extraction),
+        },
+    )
+    elapsed = time.perf_counter() - scheduled
+    if response.status_code == 200:
+        recorder.record("total", elapsed)
+    results.append(response.status_code)
+
+
+async def generate_load(app, args, recorder):
+    """
+    Drive the app at the target request rate and wait for every request to finish.
+
+    Requests are scheduled at fixed intervals whether or not earlier requests
+    have completed, and their latency is measured from the scheduled time, so
+    a slow pipeline shows up as rising latency even if it delays the sender.
+
+    Parameters:
+    - app (fastapi.FastAPI): The app to send requests to.
+    - args (argparse.Namespace): The benchmark options.
+    - recorder (fakes.StageRecorder): The recorder for stage durations.
+    """
+    with open(args.script, "rb") as f:
+        script = f.read()
+    with open(args.extraction, "rb") as f:
+        extraction = f.read()
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        start = time.perf_counter()
+        tasks = []
+        for i in range(args.requests):
+            scheduled = start + i / args.rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(
+                asyncio.create_task(send_request(client, args, i, scheduled, script, extraction, recorder, results))
+            )
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    return results, elapsed
+
+
+def run(args):
+    """
+    Run the benchmark and return its report.
+
+    Parameters:
+    - args (argparse.Namespace): The benchmark options.
+    """
+    settings = fakes.FakeSettings(
+        latency=parse_stage_values(args.latency, "--latency"),
+        failure_rate=parse_stage_values(args.failure_rate, "--failure-rate"),
+        response=args.response,
+        seed=args.seed,
+    )
+    recorder = fakes.StageRecorder()
+
+    workspace = create_workspace()
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        app = load_app(settings, recorder)
+        if args.trace_memory:
+            tracemalloc.start()
+        results, elapsed = asyncio.run(generate_load(app, args, recorder))
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+        tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    succeeded = sum(1 for status in results if status == 200)
+    return {
+        "config": {
+            "requests": args.requests,
+            "rate": args.rate,
+            "script": os.path.basename(args.script),
+            "extraction": os.path.basename(args.extraction),
+            "ground_truth": args.ground_truth,
+            "evaluators": args.evaluators,
+            "profile": args.profile,
+            "response": args.response,
+            "seed": args.seed,
+            "unique_uploads": args.unique_uploads,
+            "trace_memory": args.trace_memory,
+            "latency": settings.latency,
+            "failure_rate": settings.failure_rate,
+        },
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": succeeded / elapsed if elapsed else 0,
+        "latency": summarise(recorder.durations),
+        "memory": {
+            # ru_maxrss is reported in kilobytes on Linux
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "traced_peak_bytes": traced_peak,
+        },
+    }
+
+
+def compare(report, baseline, tolerance, min_delta_ms):
+    """
+    Compare a report against a baseline and list any regressions.
+
+    The baseline must have been recorded with the same options, since results
+    from different options cannot be compared.
+
+    Parameters:
+    - report (dict): The report for this run.
+    - baseline (dict): The recorded baseline report.
+    - tolerance (float): The allowed relative slowdown, e.g. 0.2 for 20%.
+    - min_delta_ms (float): The smallest absolute slowdown reported, to ignore noise in very fast stages.
+    """
+    differences = sorted(
+        key
+        for key in set(report["config"]) | set(baseline.get("config", {}))
+        if report["config"].get(key) != baseline.get("config", {}).get(key)
+    )
+    if differences:
+        raise ValueError(
+            f"The baseline was recorded with different options: {', '.join(differences)}. "
+            "Record a new baseline with the same options as this run."
+        )
+
+    regressions = []
+    for stage, expected in baseline["latency"].items():
+        actual = report["latency"].get(stage)
+        if actual is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            limit = max(expected[metric] * (1 + tolerance), expected[metric] + min_delta_ms)
+            if actual[metric] > limit:
+                regressions.append(
+                    f"{stage} {metric}: {actual[metric]:.2f} > baseline {expected[metric]:.2f}"
+                )
+
+    if report["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(
+            f"throughput_rps: {report['throughput_rps']:.2f} < baseline {baseline['throughput_rps']:.2f}"
+        )
+    return regressions
+
+
+def print_report(report):
+    """
+    Print a report as a table.
+
+    Parameters:
+    - report (dict): The report to print.
+    """
+    print(f"{'stage':<40} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, values in report["latency"].items():
+        print(
+            f"{stage:<40} {values['count']:>6} {values['p50_ms']:>10.2f} "
+            f"{values['p95_ms']:>10.2f} {values['p99_ms']:>10.2f}"
+        )
+    print()
+    print(f"Succeeded: {report['succeeded']}  Failed: {report['failed']}")
+    print(f"Throughput: {report['throughput_rps']:.2f} requests/s over {report['elapsed_seconds']:.2f}s")
+    print(f"Max RSS: {report['memory']['max_rss_bytes'] / 1024 / 1024:.1f} MiB")
+    if report["memory"]["traced_peak_bytes"] is not None:
+        print(f"Traced peak: {report['memory']['traced_peak_bytes'] / 1024 / 1024:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the POST / pipeline with local stand-ins for Azure, ACR and AKS."
+    )
+    parser.add_argument("--requests", type=int, default=50, help="Number of requests to send")
+    parser.add_argument("--rate", type=float, default=5.0, help="Target request rate in requests per second")
+    parser.add_argument("--script", default=os.path.join(SAMPLES_PATH, "prompt.ipynb"), help="Script to upload")
+    parser.add_argument(
+        "--extraction", default=os.path.join(SAMPLES_PATH, "extraction.json"), help="Extraction file to upload"
+    )
+    parser.add_argument("--ground-truth", default="£82m", help="Ground truth to evaluate against")
+    parser.add_argument("--evaluators", default="f1,bleu,gleu,meteor,rouge", help="Evaluators to run")
+    parser.add_argument("--profile", default="standard", help="Runtime profile to request")
+    parser.add_argument("--response", default="£82m", help="Output returned by the fake job")
+    parser.add_argument(
+        "--latency", action="append", metavar="STAGE=SECONDS", help="Latency of a faked stage (repeatable)"
+    )
+    parser.add_argument(
+        "--failure-rate", action="append", metavar="STAGE=RATE", help="Failure rate of a faked stage (repeatable)"
+    )
+    parser.add_argument("--seed", type=int, help="Seed for simulated failures")
+    parser.add_argument(
+        "--unique-uploads", action="store_true", help="Vary the script per request so every request builds an image"
+    )
+    parser.add_argument("--trace-memory", action="store_true", help="Trace Python allocations (slows the run)")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", help="Compare the report against this baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default 0.2)")
+    parser.add_argument(
+        "--min-delta-ms", type=float, default=1.0, help="Smallest latency regression reported in ms (default 1.0)"
+    )
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        except ValueError as e:
+            parser.error(str(e))
+        if regressions:
+            print("Performance regressions against baseline:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+        print("No performance regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+#!/bin/sh
+
+# Run the uploaded script; its output is read from the pod logs
+uv run python main.py
+status=$?
+
+# Read the container's peak memory and total CPU time from its cgroup (v2, falling back to v1)
+memory_bytes=$(cat /sys/fs/cgroup/memory.peak 2>/dev/null || cat /sys/fs/cgroup/memory/memory.max_usage_in_bytes 2>/dev/null)
+if [ -f /sys/fs/cgroup/cpu.stat ]; then
+    cpu_usec=$(awk '$1 == "usage_usec" {print $2}' /sys/fs/cgroup/cpu.stat)
+elif [ -f /sys/fs/cgroup/cpuacct/cpuacct.usage ]; then
+    cpu_usec=$(( $(cat /sys/fs/cgroup/cpuacct/cpuacct.usage) / 1000 ))
+fi
+
+# Write the usage to the termination message for the runtime to report
+printf '{"memory_bytes": %s, "cpu_usec": %s}' "${memory_bytes:-null}" "${cpu_usec:-null}" > /dev/termination-log
+
+exit $status
@@ -3,5 +3,13 @@ EXECUTION_SCRIPT = "main.py"
 EXTRACTION_FILE = "extraction.txt"
 MEDIA_TYPE = "application/json"
 IMAGE_NAME = "execution-sandbox"
-IMAGE_TAG = "latest"
 AKS_SECRET_NAME = "evaluation-runtime-secrets"
+POD_STARTUP_GRACE_SECONDS = 60
+STATE_STORE_PATH = "state.db"
+AZURE_LOGIN_TTL_SECONDS = 3000
+ACR_TOKEN_TTL_SECONDS = 3600
+AKS_CREDENTIALS_TTL_SECONDS = 3600
+IMAGE_CACHE_TTL_SECONDS = 86400
+TERMINATION_MESSAGE_PATH = "/dev/termination-log"
+JOB_RETENTION_SECONDS = 86400
+JOB_ID_PATTERN = r"^[a-z0-9]([-a-z0-9]{0,34}[a-z0-9])?$"
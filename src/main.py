@@ -1,13 +1,16 @@
+import hashlib
 import json
 import logging
 import os
+import re
 import uuid
 
 import constants
 import dotenv
 import fastapi
 import uvicorn
-from utils import azure, evaluation, file, kubernetes, notebook
+from fastapi import concurrency
+from utils import azure, evaluation, file, kubernetes, notebook, profiles, store
 from utils import docker as docker_mod
 
 # Configure logging
@@ -18,163 +21,385 @@ logging.basicConfig(
 # Load environment variables
 dotenv.load_dotenv()
 
+
+def get_int_env(name, default, minimum) -> int:
+    """
+    Get an integer setting from an environment variable, using the default when it is unset or empty.
+
+    Parameters:
+    - name (str): The name of the environment variable.
+    - default (int): The value to use when the variable is unset or empty.
+    - minimum (int): The smallest value allowed.
+    """
+    value = os.getenv(name) or str(default)
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or number < minimum:
+        raise ValueError(f"{name} must be an integer of at least {minimum}, got '{value}'")
+    return number
+
+
 # Get environment variables
 registry_name = os.getenv("ACR_NAME")
 resource_group = os.getenv("RESOURCE_GROUP_NAME")
 aks_cluster = os.getenv("AKS_NAME")
 openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
+workers = get_int_env("WORKERS", 1, 1)
+result_cache_seconds = get_int_env("RESULT_CACHE_SECONDS", 0, 0)
+
+# Load the runtime profiles once so that an invalid profiles file stops the server at startup
+available_profiles = profiles.load_profiles()
+
+# Set up the store shared by all workers, so that an unusable path stops the server at startup
+store.initialise()
 
 # Create the FastAPI app
 app = fastapi.FastAPI()
 
 
-# Define the endpoint to evaluate the code
+def set_job_status(job_id, status, error=None) -> None:
+    """
+    Update the status of a job in the job registry, logging rather than raising any error.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    - status (str): The new status of the job.
+    - error (str): The error the job failed with (default is none).
+    """
+    try:
+        store.update_job(job_id, status, error)
+    except Exception as e:
+        logging.error(f"Error updating job {job_id} to '{status}': {e}")
+
+
+def job_failed(job_id, error) -> fastapi.Response:
+    """
+    Mark a job as failed in the job registry and create the error response.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    - error (Exception): The error the job failed with.
+    """
+    set_job_status(job_id, "failed", str(error))
+    return fastapi.Response(
+        content=json.dumps({"error": str(error), "job_id": job_id}),
+        media_type=constants.MEDIA_TYPE,
+        status_code=500,
+    )
+
+
+def login_to_azure() -> None:
+    """
+    Perform Azure login, unless another request has done so recently.
+
+    Only one request across all workers logs in at a time; the others wait and
+    then use its login.
+    """
+    if store.get_value("azure_login"):
+        return
+
+    with store.lock("azure_login"):
+        if not store.get_value("azure_login"):
+            azure.azure_login()
+            store.set_value("azure_login", True, constants.AZURE_LOGIN_TTL_SECONDS)
+
+
+def build_and_push_image(build_path, fqdn_registry, image_tag, container_image) -> str:
+    """
+    Build and push the execution image, unless an image with the same contents has already been pushed.
+
+    Parameters:
+    - build_path (str): The directory containing the Dockerfile and uploaded files.
+    - fqdn_registry (str): The fully qualified domain name (FQDN) of the container registry.
+    - image_tag (str): The content-hash tag for the image.
+    - container_image (str): The full name and tag of the image.
+
+    Returns:
+    - str: The reference to run the image by, using its registry digest.
+    """
+    image_key = f"image:{container_image}"
+    image_reference = store.get_value(image_key)
+    if image_reference:
+        logging.info(f"Using cached image {image_reference}")
+        return image_reference
+
+    # Create a Docker client authenticated with the ACR
+    docker = docker_mod.DockerWrapper()
+
+    # Build the Docker image
+    docker.build(
+        path=f"./{build_path}",
+        tag=container_image,
+    )
+
+    # Push the Docker image to the Azure Container Registry
+    repository = f"{fqdn_registry}/{constants.IMAGE_NAME}"
+    docker.push(repository=repository, tag=image_tag, registry=fqdn_registry)
+
+    # Record the pushed image digest so other requests and workers can skip the build
+    image_reference = docker.get_digest(container_image, repository)
+    store.set_value(image_key, image_reference, constants.IMAGE_CACHE_TTL_SECONDS)
+    return image_reference
+
+
+def run_job(job_id, image_reference, runtime_profile, ground_truth, evaluators) -> tuple[str, dict, dict]:
+    """
+    Run the execution image as a job on the Azure Kubernetes Service and evaluate its output.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    - image_reference (str): The image to run, by digest.
+    - runtime_profile (dict): The runtime profile for the sandbox pod.
+    - ground_truth (str): The expected answer to evaluate against.
+    - evaluators (str): The comma-separated evaluators to run.
+
+    Returns:
+    - tuple: The pod logs, the resource usage and the evaluation results.
+    """
+    # Create a Kubernetes client
+    aks = kubernetes.KubernetesWrapper(resource_group, aks_cluster)
+
+    # Create job and pod names
+    pod_name = f"execution-pod-{job_id}"
+    job_name = f"execution-job-{job_id}"
+
+    # Create the secrets, container, pod, and job
+    secret_data = {
+        "AZURE_OPENAI_ENDPOINT": openai_endpoint,
+        "AZURE_OPENAI_API_KEY": openai_api_key,
+    }
+
+    aks.create_secrets(constants.AKS_SECRET_NAME, secret_data)
+    # Run the image by digest, so the pod runs exactly the image that was pushed
+    container = aks.create_container(
+        image_reference,
+        job_name,
+        pull_policy=runtime_profile["pull_policy"],
+        resources=aks.create_resources(runtime_profile),
+    )
+    pod_spec = aks.create_pod_template(
+        pod_name,
+        container,
+        active_deadline_seconds=runtime_profile["active_deadline_seconds"],
+        node_selector=runtime_profile["node_selector"],
+        tolerations=runtime_profile["tolerations"],
+        node_affinity=runtime_profile["node_affinity"],
+    )
+    job = aks.create_job(job_name, pod_spec)
+
+    # Execute the job
+    aks.execute_job(job)
+
+    # Poll the pod status until it is completed, allowing time for scheduling and image pulls
+    timeout = runtime_profile["active_deadline_seconds"] + constants.POD_STARTUP_GRACE_SECONDS
+    if aks.wait_for_pod_completion(job_name, timeout=timeout) is False:
+        raise Exception("Job did not complete successfully")
+
+    # Capture the logs and resource usage from the pod for the job
+    logs = aks.get_logs(job_name)
+    usage = aks.get_usage()
+
+    # Create the data for evaluation
+    data = dict(
+        response=logs,
+        ground_truth=ground_truth,
+    )
+
+    # Perform the evaluation
+    evaluator_list = evaluators.split(",")
+    eval_results = evaluation.evaluate(evaluator_list, data)
+    return logs, usage, eval_results
+
+
+# Define the endpoint to evaluate the code. The blocking Azure, Docker and Kubernetes
+# steps run in the threadpool so that the event loop keeps serving other requests.
 @app.post("/")
 async def evaluate_code(
     ground_truth: str = fastapi.Form(...),
     evaluators: str = fastapi.Form(...),
     extraction: fastapi.UploadFile = fastapi.File(...),
     script: fastapi.UploadFile = fastapi.File(...),
+    profile: str = fastapi.Form(profiles.DEFAULT_PROFILE),
+    job_id: str | None = fastapi.Form(None),
 ) -> fastapi.Response:
 
     logging.info("Received a request to execute code")
 
-    # Create the full registry and container image names
-    fqdn_registry = f"{registry_name}.azurecr.io"
-    container_image = f"{fqdn_registry}/{constants.IMAGE_NAME}:{constants.IMAGE_TAG}"
+    # Use the job ID supplied by the client, so it can poll the job while this request runs
+    if job_id is None:
+        job_id = str(uuid.uuid4())
+    elif not re.fullmatch(constants.JOB_ID_PATTERN, job_id):
+        logging.error(f"Invalid job ID: {job_id}")
+        return fastapi.Response(
+            content=json.dumps(
+                {"error": "job_id must be 1-36 lowercase letters, digits or hyphens, starting and ending with "
+                          "a letter or digit"}
+            ),
+            media_type=constants.MEDIA_TYPE,
+            status_code=400,
+        )
 
-    # Perform Azure login
+    # Resolve the runtime profile for the sandbox pod
     try:
-        azure.azure_login()
-    except Exception as e:
-        logging.error(f"Error logging in to Azure: {e}")
+        runtime_profile = profiles.get_profile(available_profiles, profile)
+    except ValueError as e:
+        logging.error(f"Error resolving runtime profile: {e}")
         return fastapi.Response(
             content=json.dumps({"error": str(e)}),
             media_type=constants.MEDIA_TYPE,
+            status_code=400,
+        )
+    profile = profile or profiles.DEFAULT_PROFILE
+
+    # Register the job so that its status is visible to every worker
+    try:
+        registered = store.register_job(job_id, profile)
+    except Exception as e:
+        logging.error(f"Error registering job: {e}")
+        return fastapi.Response(
+            content=json.dumps({"error": str(e), "job_id": job_id}),
+            media_type=constants.MEDIA_TYPE,
             status_code=500,
         )
+    if not registered:
+        logging.error(f"Job ID already in use: {job_id}")
+        return fastapi.Response(
+            content=json.dumps({"error": f"Job '{job_id}' already exists"}),
+            media_type=constants.MEDIA_TYPE,
+            status_code=409,
+        )
 
-    # Handle the uploaded files for execution
+    # Create the full registry name and a build directory for this job
+    fqdn_registry = f"{registry_name}.azurecr.io"
+    build_path = os.path.join(constants.SAVE_PATH, job_id)
+
+    # Perform Azure login, unless another request has done so recently
     try:
-        # Check if the code directory exists
-        os.makedirs(constants.SAVE_PATH, exist_ok=True)
+        await concurrency.run_in_threadpool(login_to_azure)
+    except Exception as e:
+        logging.error(f"Error logging in to Azure: {e}")
+        return job_failed(job_id, e)
 
-        # Empty out the code directory
-        file.delete_all_files_in_path(constants.SAVE_PATH)
+    # Handle the uploaded files for execution
+    try:
+        # Create the build directory for this job
+        os.makedirs(build_path, exist_ok=True)
 
         # Save the uploaded file
         filename = script.filename or "script.py"
         if filename.endswith(".ipynb"):
-            file_location = os.path.join(constants.SAVE_PATH, filename)
+            file_location = os.path.join(build_path, filename)
             await file.write_file(script, file_location)
             # Convert the Jupyter Notebook to a Python script
             await notebook.convert_notebook_to_script(
-                file_location, f"{constants.SAVE_PATH}/{constants.EXECUTION_SCRIPT}"
+                file_location, f"{build_path}/{constants.EXECUTION_SCRIPT}"
             )
         else:
-            file_location = os.path.join(constants.SAVE_PATH, constants.EXECUTION_SCRIPT)
+            file_location = os.path.join(build_path, constants.EXECUTION_SCRIPT)
             await file.write_file(script, file_location)
 
         # Save the extraction file contents
-        file_location = os.path.join(constants.SAVE_PATH, constants.EXTRACTION_FILE)
+        file_location = os.path.join(build_path, constants.EXTRACTION_FILE)
         extraction_file = await extraction.read()
         extraction_json = extraction_file.decode("utf-8")
         extraction_content = json.loads(extraction_json)
         await file.write_file(extraction_content.get("content"), file_location, "w")
 
         # Copy the Dockerfile from the boilerplate folder to the execution directory
-        file.copy_file("src/boilerplate/Dockerfile", constants.SAVE_PATH)
-        file.copy_file("src/boilerplate/pyproject.toml", constants.SAVE_PATH)
+        file.copy_file("src/boilerplate/Dockerfile", build_path)
+        file.copy_file("src/boilerplate/pyproject.toml", build_path)
+        file.copy_file("src/boilerplate/run.sh", build_path)
+
+        # Tag the image with a hash of its contents so identical uploads share an image
+        image_tag = file.hash_files(build_path)[:32]
+        container_image = f"{fqdn_registry}/{constants.IMAGE_NAME}:{image_tag}"
     except Exception as e:
         logging.error(f"Error handling the uploaded file: {e}")
-        return fastapi.Response(
-            content=json.dumps({"error": str(e)}),
-            media_type=constants.MEDIA_TYPE,
-            status_code=500,
-        )
+        file.delete_path(build_path)
+        return job_failed(job_id, e)
+
+    # Return a cached result for an identical request if result caching is enabled
+    result_key = None
+    if result_cache_seconds:
+        request_hash = hashlib.sha256(
+            json.dumps([image_tag, profile, ground_truth, evaluators]).encode("utf-8")
+        ).hexdigest()
+        result_key = f"result:{request_hash}"
+        cached_result = store.get_value(result_key)
+        if cached_result:
+            logging.info("Returning cached result")
+            file.delete_path(build_path)
+            set_job_status(job_id, "succeeded")
+            return fastapi.Response(
+                content=json.dumps({**cached_result, "job_id": job_id, "cached": True}),
+                media_type=constants.MEDIA_TYPE,
+                status_code=200,
+            )
 
-    # Attempt to build and push the Docker image
+    # Attempt to build and push the Docker image, unless it has already been pushed
     try:
-        # Create a Docker client authenticated with the ACR
-        docker = docker_mod.DockerWrapper()
-
-        # Build the Docker image
-        docker.build(
-            path=f"./{constants.SAVE_PATH}",
-            tag=container_image,
+        image_reference = await concurrency.run_in_threadpool(
+            build_and_push_image, build_path, fqdn_registry, image_tag, container_image
         )
-
-        # Push the Docker image to the Azure Container Registry
-        docker.push(repository=f"{fqdn_registry}/{constants.IMAGE_NAME}", tag=constants.IMAGE_TAG, registry=fqdn_registry)
     except Exception as e:
         logging.error(f"Error building or pushing Docker image: {e}")
-        return fastapi.Response(
-            content=json.dumps({"error": str(e)}),
-            media_type=constants.MEDIA_TYPE,
-            status_code=500,
-        )
+        return job_failed(job_id, e)
+    finally:
+        file.delete_path(build_path)
 
     # Attempt to execute the job on the Azure Kubernetes Service
     try:
-        # Create a Kubernetes client
-        aks = kubernetes.KubernetesWrapper(resource_group, aks_cluster)
-
-        # Create job and pod names
-        job_id = uuid.uuid4()
-        pod_name = f"execution-pod-{job_id}"
-        job_name = f"execution-job-{job_id}"
-
-        # Create the secrets, container, pod, and job
-        secret_data = {
-            "AZURE_OPENAI_ENDPOINT": openai_endpoint,
-            "AZURE_OPENAI_API_KEY": openai_api_key,
-        }
-
-        aks.create_secrets(constants.AKS_SECRET_NAME, secret_data)
-        container = aks.create_container(container_image, job_name)
-        pod_spec = aks.create_pod_template(pod_name, container)
-        job = aks.create_job(job_name, pod_spec)
-
-        # Execute the job
-        aks.execute_job(job)
-
-        # Poll the pod status until it is completed
-        if aks.wait_for_pod_completion(job_name) is False:
-            raise Exception("Job did not complete successfully")
-
-        # Capture the logs from the pod for the job
-        logs = aks.get_logs(job_name)
-
-        # Create the data for evaluation
-        data = dict(
-            response=logs,
-            ground_truth=ground_truth,
+        logs, usage, eval_results = await concurrency.run_in_threadpool(
+            run_job, job_id, image_reference, runtime_profile, ground_truth, evaluators
         )
-
-        # Perform the evaluation
-        evaluator_list = evaluators.split(",")
-        eval_results = evaluation.evaluate(evaluator_list, data)
-
     except Exception as e:
         logging.error(f"Error executing job: {e}")
-        return fastapi.Response(
-            content=json.dumps({"error": str(e)}),
-            media_type=constants.MEDIA_TYPE,
-            status_code=500,
-        )
+        return job_failed(job_id, e)
 
     logging.info("Job execution completed successfully")
+    set_job_status(job_id, "succeeded")
 
     response_content = {
         "response": logs,
         "ground_truth": ground_truth,
         "evaluation": eval_results,
+        "usage": {"profile": profile, **usage},
     }
+    if result_key:
+        store.set_value(result_key, response_content, result_cache_seconds)
 
     # Return the response
     return fastapi.Response(
-        content=json.dumps(response_content),
+        content=json.dumps({**response_content, "job_id": job_id}),
+        media_type=constants.MEDIA_TYPE,
+        status_code=200,
+    )
+
+
+# Define the endpoint to get the status of a job from any worker
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> fastapi.Response:
+    try:
+        job = store.get_job(job_id)
+    except Exception as e:
+        logging.error(f"Error reading job {job_id}: {e}")
+        return fastapi.Response(
+            content=json.dumps({"error": str(e)}),
+            media_type=constants.MEDIA_TYPE,
+            status_code=500,
+        )
+    if job is None:
+        return fastapi.Response(
+            content=json.dumps({"error": f"Job '{job_id}' not found"}),
+            media_type=constants.MEDIA_TYPE,
+            status_code=404,
+        )
+
+    return fastapi.Response(
+        content=json.dumps(job),
         media_type=constants.MEDIA_TYPE,
         status_code=200,
     )
@@ -182,5 +407,5 @@ async def evaluate_code(
 
 # Entry point of the script
 if __name__ == "__main__":
-    # Create the Uvicorn server
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
+    # Create the Uvicorn server, running one process per worker when WORKERS is above 1
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False, workers=workers)
@@ -2,9 +2,14 @@ import json
 import logging
 import os
 import subprocess
+import time
 
+import constants
 from azure import identity
 
+# ACR access tokens keyed by registry, held in this process only so that credentials are never written to disk
+acr_tokens: dict[str, dict] = {}
+
 
 def is_running_in_docker():
     return (
@@ -21,8 +26,12 @@ def azure_login():
         tenant_id = os.getenv("AZURE_TENANT_ID")
         client_id = os.getenv("AZURE_CLIENT_ID")
         client_secret = os.getenv("AZURE_CLIENT_SECRET")
-        command = f"az login --service-principal -u {client_id} -p {client_secret} --tenant {tenant_id}"
-        subprocess.run(command, shell=True)
+        command = ["az", "login", "--service-principal", "-u", client_id, "-p", client_secret, "--tenant", tenant_id]
+        try:
+            subprocess.run(command, stderr=subprocess.PIPE, text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            # Raise without the command, which contains the client secret
+            raise RuntimeError(f"az login failed with exit status {e.returncode}: {e.stderr.strip()}") from None
     else:
         # Clear any environment variables to ensure local account is used
         if "AZURE_CLIENT_ID" in os.environ:
@@ -40,9 +49,16 @@ def authenticate_acr(registry_name):
     """
     Authenticate with the Azure Container Registry.
 
+    The access token is cached in memory by each worker until it expires.
+
     Parameters:
     - registry_name (str): The name of the Azure Container Registry.
     """
+    cached_token = acr_tokens.get(registry_name)
+    if cached_token and cached_token["expires_at"] > time.time():
+        logging.info(f"Using cached access token for {registry_name}")
+        return cached_token["access_token"]
+
     logging.info(f"Authenticating with {registry_name}")
     result = subprocess.run(
         ["az", "acr", "login", "--name", registry_name, "--expose-token"],
@@ -52,4 +68,8 @@ def authenticate_acr(registry_name):
     )
     token_info = json.loads(result.stdout)
     access_token = token_info["accessToken"]
+    acr_tokens[registry_name] = {
+        "access_token": access_token,
+        "expires_at": time.time() + constants.ACR_TOKEN_TTL_SECONDS,
+    }
     return access_token
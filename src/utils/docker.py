@@ -48,4 +48,26 @@ class DockerWrapper:
         """
         self.login(registry)
         logging.info(f"Pushing image to repository {repository} with tag {tag}")
-        self.client.images.push(repository=repository, tag=tag)
+
+        # The push does not raise on registry errors; they are reported in the output stream
+        for line in self.client.images.push(repository=repository, tag=tag, stream=True, decode=True):
+            if "error" in line or "errorDetail" in line:
+                message = line.get("errorDetail", {}).get("message") or line.get("error")
+                raise RuntimeError(f"Error pushing {repository}:{tag}: {message}")
+
+    def get_digest(self, tag, repository):
+        """
+        Get the registry digest of a pushed Docker image.
+
+        Parameters:
+        - tag (str): The full tag of the Docker image.
+        - repository (str): The repository the image was pushed to.
+
+        Returns:
+        - str: The repository digest reference, in the form 'repository@sha256:...'.
+        """
+        repo_digests = self.client.images.get(tag).attrs.get("RepoDigests") or []
+        for repo_digest in repo_digests:
+            if repo_digest.startswith(f"{repository}@"):
+                return repo_digest
+        raise RuntimeError(f"No digest found for {tag} in {repository} after pushing")
@@ -1,4 +1,5 @@
 import glob
+import hashlib
 import logging
 import os
 import shutil
@@ -6,20 +7,36 @@ import shutil
 import fastapi
 
 
-def delete_all_files_in_path(path) -> None:
+def delete_path(path) -> None:
     """
-    Delete all files in the specified path.
+    Delete a directory and everything in it.
+
+    Parameters:
+    - path (str): The path to the directory.
+    """
+    try:
+        shutil.rmtree(path)
+        logging.info(f"Deleted: {path}")
+    except Exception as e:
+        logging.error(f"Error deleting {path}: {e}")
+
+
+def hash_files(path) -> str:
+    """
+    Calculate a SHA-256 hash over the names and contents of the files in a path.
 
     Parameters:
     - path (str): The path to the folder.
+
+    Returns:
+    - str: The hex digest of the hash.
     """
-    files = glob.glob(os.path.join(path, "*"))
-    for file in files:
-        try:
-            os.remove(file)
-            logging.info(f"Deleted: {file}")
-        except Exception as e:
-            logging.error(f"Error deleting {file}: {e}")
+    digest = hashlib.sha256()
+    for file in sorted(glob.glob(os.path.join(path, "*"))):
+        digest.update(os.path.basename(file).encode("utf-8"))
+        with open(file, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
 
 
 def copy_file(source_path, destination_path) -> None:
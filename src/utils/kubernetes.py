@@ -1,3 +1,4 @@
+import json
 import logging
 import subprocess
 import time
@@ -5,6 +6,7 @@ import time
 import constants
 from kubernetes import client, config
 from kubernetes.client import rest
+from utils import store
 
 
 class KubernetesWrapper:
@@ -23,29 +25,44 @@ class KubernetesWrapper:
         self.namespace = namespace
         self.authenticate(resource_group_name, aks_cluster_name)
         self.core = client.CoreV1Api()
+        self.usage = {"cpu_millicores": None, "cpu_seconds": None, "memory_bytes": None, "duration_seconds": None}
 
     def authenticate(self, resource_group_name, aks_cluster_name):
         """
         Authenticate with the Azure Kubernetes Service (AKS) cluster.
 
+        The cluster credentials are written to the shared kubeconfig file, so they are only
+        fetched again once the entry in the shared store expires. A lock shared by the
+        workers stops them fetching the credentials at the same time.
+
         Parameters:
         - resource_group_name (str): The name of the Azure resource group.
         - aks_cluster_name (str): The name of the Azure Kubernetes Service (AKS) cluster.
         """
-        subprocess.run(
-            [
-                "az",
-                "aks",
-                "get-credentials",
-                "--resource-group",
-                resource_group_name,
-                "--name",
-                aks_cluster_name,
-            ],
-            check=True,
-        )
+        cache_key = f"aks_credentials:{resource_group_name}:{aks_cluster_name}"
+
+        # Only one worker writes the kubeconfig file at a time, and none reads it mid-write
+        with store.lock("kubeconfig"):
+            cached = store.get_value(cache_key)
+            if cached:
+                logging.info(f"Using cached credentials for {aks_cluster_name}")
+            else:
+                subprocess.run(
+                    [
+                        "az",
+                        "aks",
+                        "get-credentials",
+                        "--resource-group",
+                        resource_group_name,
+                        "--name",
+                        aks_cluster_name,
+                    ],
+                    check=True,
+                )
 
-        config.load_kube_config()
+            config.load_kube_config()
+            if not cached:
+                store.set_value(cache_key, True, constants.AKS_CREDENTIALS_TTL_SECONDS)
 
     def create_secrets(self, secret_name, secret_data):
         """
@@ -91,7 +108,19 @@ class KubernetesWrapper:
             else:
                 raise e
 
-    def create_container(self, image, name, pull_policy="Always"):
+    def create_resources(self, profile):
+        """
+        Create the resource requests and limits for a container from a runtime profile.
+
+        Parameters:
+        - profile (dict): The runtime profile to take the CPU and memory settings from.
+        """
+        return client.V1ResourceRequirements(
+            requests={"cpu": profile["cpu_request"], "memory": profile["memory_request"]},
+            limits={"cpu": profile["cpu_limit"], "memory": profile["memory_limit"]},
+        )
+
+    def create_container(self, image, name, pull_policy="Always", resources=None):
         """
         Create a container definition for a Kubernetes pod.
 
@@ -99,6 +128,7 @@ class KubernetesWrapper:
         - image (str): The name of the Docker image to use.
         - name (str): The name to assign to the container.
         - pull_policy (str): The image pull policy to use (default is 'Always').
+        - resources (V1ResourceRequirements): The resource requests and limits to apply (default is none).
         """
         logging.info(f"Creating container with image: {image}")
 
@@ -106,6 +136,8 @@ class KubernetesWrapper:
             image=image,
             name=name,
             image_pull_policy=pull_policy,
+            resources=resources,
+            termination_message_path=constants.TERMINATION_MESSAGE_PATH,
             env=[
                 client.V1EnvVar(
                     name="AZURE_OPENAI_ENDPOINT",
@@ -129,17 +161,64 @@ class KubernetesWrapper:
         )
         return container
 
-    def create_pod_template(self, pod_name, container):
+    def create_pod_template(
+        self,
+        pod_name,
+        container,
+        active_deadline_seconds=None,
+        node_selector=None,
+        tolerations=None,
+        node_affinity=None,
+    ):
         """
         Create a pod template for a Kubernetes job.
 
         Parameters:
         - pod_name (str): The name to assign to the pod.
         - container (V1Container): The container definition to use.
+        - active_deadline_seconds (int): The time after which the pod is terminated (default is no deadline).
+        - node_selector (dict): The node labels the pod must be scheduled onto (default is any node).
+        - tolerations (list): The taints the pod tolerates, as dicts using Kubernetes field names (default is none).
+        - node_affinity (list): Match expressions, as dicts with key, operator and values, that the node
+          must satisfy (default is none).
         """
         logging.info(f"Creating pod template with name: {pod_name}")
+        pod_tolerations = [
+            client.V1Toleration(
+                key=toleration.get("key"),
+                operator=toleration.get("operator"),
+                value=toleration.get("value"),
+                effect=toleration.get("effect"),
+                toleration_seconds=toleration.get("tolerationSeconds"),
+            )
+            for toleration in tolerations or []
+        ]
+        affinity = None
+        if node_affinity:
+            match_expressions = [
+                client.V1NodeSelectorRequirement(
+                    key=expression["key"],
+                    operator=expression["operator"],
+                    values=expression.get("values") or None,
+                )
+                for expression in node_affinity
+            ]
+            affinity = client.V1Affinity(
+                node_affinity=client.V1NodeAffinity(
+                    required_during_scheduling_ignored_during_execution=client.V1NodeSelector(
+                        node_selector_terms=[client.V1NodeSelectorTerm(match_expressions=match_expressions)]
+                    )
+                )
+            )
         pod_template = client.V1PodTemplateSpec(
-            spec=client.V1PodSpec(restart_policy="Never", containers=[container]),
+            spec=client.V1PodSpec(
+                restart_policy="Never",
+                containers=[container],
+                active_deadline_seconds=active_deadline_seconds,
+                node_selector=node_selector or None,
+                tolerations=pod_tolerations or None,
+                affinity=affinity,
+            ),
             metadata=client.V1ObjectMeta(name=pod_name, labels={"pod_name": pod_name}),
         )
         return pod_template
@@ -173,30 +252,75 @@ class KubernetesWrapper:
         batch_api = client.BatchV1Api()
         batch_api.create_namespaced_job(self.namespace, job)
 
-    def wait_for_pod_completion(self, job_name):
+    def wait_for_pod_completion(self, job_name, timeout=60):
         """
         Wait for a Kubernetes job to complete.
 
         Parameters:
         - job_name (str): The name of the job to wait for.
+        - timeout (int): The number of seconds to wait before giving up (default is 60).
         """
         logging.info("Waiting for job to complete...")
         pod_ready = False
-        for _ in range(30):  # Try for 30 iterations (30 x 2 = 60 seconds)
+        for _ in range(max(timeout // 2, 1)):  # Poll every 2 seconds until the timeout
             pods = self.core.list_namespaced_pod(
                 namespace=self.namespace, label_selector=f"job-name={job_name}"
             )
             if pods.items:
-                logging.info(f"Pod status: {pods.items[0].status.phase}")
-                pod_status = pods.items[0].status.phase
+                pod = pods.items[0]
+                logging.info(f"Pod status: {pod.status.phase}")
+                pod_status = pod.status.phase
                 if pod_status == "Succeeded":
+                    self.record_usage(pod)
                     pod_ready = True
                     break
                 elif pod_status == "Failed":
+                    if pod.status.reason == "DeadlineExceeded":
+                        raise RuntimeError("Job exceeded its runtime profile deadline")
                     raise RuntimeError("Job failed to complete")
             time.sleep(2)
         return pod_ready
 
+    def record_usage(self, pod):
+        """
+        Record the resource usage of a completed pod.
+
+        The sandbox writes its cgroup peak memory and CPU time to the termination
+        message when the script exits, and the run time comes from the container state.
+
+        Parameters:
+        - pod (V1Pod): The completed pod.
+        """
+        for status in pod.status.container_statuses or []:
+            terminated = status.state.terminated
+            if not terminated:
+                continue
+
+            if terminated.started_at and terminated.finished_at:
+                duration = terminated.finished_at - terminated.started_at
+                self.usage["duration_seconds"] = duration.total_seconds()
+
+            try:
+                message = json.loads(terminated.message or "{}")
+            except ValueError:
+                logging.warning(f"Could not read resource usage from termination message: {terminated.message}")
+                continue
+
+            self.usage["memory_bytes"] = message.get("memory_bytes")
+            if message.get("cpu_usec") is not None:
+                self.usage["cpu_seconds"] = message["cpu_usec"] / 1_000_000
+                if self.usage["duration_seconds"]:
+                    cpu_millicores = self.usage["cpu_seconds"] / self.usage["duration_seconds"] * 1000
+                    self.usage["cpu_millicores"] = round(cpu_millicores)
+
+    def get_usage(self) -> dict:
+        """
+        Get the resource usage recorded when the job completed.
+
+        Values are None when the sandbox could not read its cgroup statistics.
+        """
+        return dict(self.usage)
+
     def get_logs(self, job_name) -> str:
         """
         Get logs from a Kubernetes pod.
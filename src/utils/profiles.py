@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+
+# Built-in runtime profiles for sandbox pods. Each profile sets the resource
+# requests and limits for the execution container, the deadline after which
+# Kubernetes terminates the pod, the node placement and the image pull policy.
+# Node affinity entries are required node selector match expressions, all of
+# which a node must satisfy.
+runtime_profiles = {
+    "small": {
+        "cpu_request": "100m",
+        "cpu_limit": "500m",
+        "memory_request": "128Mi",
+        "memory_limit": "256Mi",
+        "active_deadline_seconds": 60,
+        "node_selector": {},
+        "tolerations": [],
+        "node_affinity": [],
+        "pull_policy": "IfNotPresent",
+    },
+    "standard": {
+        "cpu_request": "250m",
+        "cpu_limit": "1",
+        "memory_request": "256Mi",
+        "memory_limit": "512Mi",
+        "active_deadline_seconds": 120,
+        "node_selector": {},
+        "tolerations": [],
+        "node_affinity": [],
+        "pull_policy": "IfNotPresent",
+    },
+    "large": {
+        "cpu_request": "1",
+        "cpu_limit": "2",
+        "memory_request": "1Gi",
+        "memory_limit": "2Gi",
+        "active_deadline_seconds": 300,
+        "node_selector": {},
+        "tolerations": [],
+        "node_affinity": [],
+        "pull_policy": "IfNotPresent",
+    },
+}
+
+DEFAULT_PROFILE = "standard"
+
+
+PULL_POLICIES = ["Always", "IfNotPresent", "Never"]
+
+TOLERATION_KEYS = ["key", "operator", "value", "effect", "tolerationSeconds"]
+
+NODE_AFFINITY_KEYS = ["key", "operator", "values"]
+
+NODE_AFFINITY_OPERATORS = ["In", "NotIn", "Exists", "DoesNotExist", "Gt", "Lt"]
+
+
+def validate_profile(name, profile) -> None:
+    """
+    Check that a runtime profile has every setting, with values of the right type.
+
+    Parameters:
+    - name (str): The name of the profile, used in error messages.
+    - profile (dict): The runtime profile settings.
+    """
+    for key in ["cpu_request", "cpu_limit", "memory_request", "memory_limit"]:
+        if not isinstance(profile.get(key), str) or not profile[key]:
+            raise ValueError(f"Runtime profile '{name}' must set '{key}' to a Kubernetes quantity string")
+
+    deadline = profile.get("active_deadline_seconds")
+    if not isinstance(deadline, int) or isinstance(deadline, bool) or deadline < 1:
+        raise ValueError(f"Runtime profile '{name}' must set 'active_deadline_seconds' to a positive integer")
+
+    node_selector = profile.get("node_selector")
+    if not isinstance(node_selector, dict) or not all(
+        isinstance(key, str) and isinstance(value, str) for key, value in node_selector.items()
+    ):
+        raise ValueError(f"Runtime profile '{name}' must set 'node_selector' to an object of string labels")
+
+    tolerations = profile.get("tolerations")
+    if not isinstance(tolerations, list) or not all(isinstance(toleration, dict) for toleration in tolerations):
+        raise ValueError(f"Runtime profile '{name}' must set 'tolerations' to a list of objects")
+    for toleration in tolerations:
+        unknown_keys = sorted(set(toleration) - set(TOLERATION_KEYS))
+        if unknown_keys:
+            raise ValueError(
+                f"Runtime profile '{name}' has unknown toleration keys: {', '.join(unknown_keys)}. "
+                f"Allowed keys: {', '.join(TOLERATION_KEYS)}"
+            )
+
+    node_affinity = profile.get("node_affinity")
+    if not isinstance(node_affinity, list) or not all(isinstance(expression, dict) for expression in node_affinity):
+        raise ValueError(f"Runtime profile '{name}' must set 'node_affinity' to a list of objects")
+    for expression in node_affinity:
+        unknown_keys = sorted(set(expression) - set(NODE_AFFINITY_KEYS))
+        if unknown_keys:
+            raise ValueError(
+                f"Runtime profile '{name}' has unknown node affinity keys: {', '.join(unknown_keys)}. "
+                f"Allowed keys: {', '.join(NODE_AFFINITY_KEYS)}"
+            )
+        if not isinstance(expression.get("key"), str) or not expression["key"]:
+            raise ValueError(f"Runtime profile '{name}' must set 'key' on every node affinity entry")
+        if expression.get("operator") not in NODE_AFFINITY_OPERATORS:
+            raise ValueError(
+                f"Runtime profile '{name}' must set the node affinity 'operator' to one of: "
+                f"{', '.join(NODE_AFFINITY_OPERATORS)}"
+            )
+        values = expression.get("values", [])
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"Runtime profile '{name}' must set node affinity 'values' to a list of strings")
+        operator = expression["operator"]
+        if operator in ["In", "NotIn"] and not values:
+            raise ValueError(f"Runtime profile '{name}' must set node affinity 'values' for operator '{operator}'")
+        if operator in ["Exists", "DoesNotExist"] and values:
+            raise ValueError(f"Runtime profile '{name}' must not set node affinity 'values' for operator '{operator}'")
+        if operator in ["Gt", "Lt"] and (len(values) != 1 or not values[0].lstrip("-").isdigit()):
+            raise ValueError(
+                f"Runtime profile '{name}' must set one integer node affinity value for operator '{operator}'"
+            )
+
+    if profile.get("pull_policy") not in PULL_POLICIES:
+        raise ValueError(f"Runtime profile '{name}' must set 'pull_policy' to one of: {', '.join(PULL_POLICIES)}")
+
+
+def load_profiles(path=None) -> dict:
+    """
+    Load and validate the runtime profiles, applying any overrides from a JSON file.
+
+    The file is a JSON object keyed by profile name. Entries for an existing
+    profile are merged over the built-in values, and new names add profiles.
+    Call this once at startup so that a missing or invalid file stops the server.
+
+    Parameters:
+    - path (str): The path to the JSON overrides file (default is the RUNTIME_PROFILES_FILE environment variable).
+
+    Returns:
+    - dict: The runtime profiles keyed by name.
+    """
+    profiles = {name: dict(values) for name, values in runtime_profiles.items()}
+    path = path or os.getenv("RUNTIME_PROFILES_FILE")
+    if path:
+        logging.info(f"Loading runtime profiles from {path}")
+        with open(path, "r") as f:
+            overrides = json.load(f)
+
+        if not isinstance(overrides, dict) or not all(isinstance(values, dict) for values in overrides.values()):
+            raise ValueError(f"Runtime profiles file '{path}' must be a JSON object of profile objects")
+
+        for name, values in overrides.items():
+            base = profiles.get(name, profiles[DEFAULT_PROFILE])
+            profiles[name] = {**base, **values}
+
+    for name, profile in profiles.items():
+        validate_profile(name, profile)
+    return profiles
+
+
+def get_profile(profiles, name) -> dict:
+    """
+    Get a runtime profile by name.
+
+    Parameters:
+    - profiles (dict): The runtime profiles returned by load_profiles.
+    - name (str): The name of the profile (default profile is used when empty).
+
+    Returns:
+    - dict: The runtime profile settings.
+    """
+    name = name or DEFAULT_PROFILE
+    profile = profiles.get(name)
+    if profile is None:
+        raise ValueError(
+            f"Unknown runtime profile '{name}'. Available profiles: {', '.join(sorted(profiles))}"
+        )
+    return profile
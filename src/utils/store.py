@@ -0,0 +1,269 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import constants
+
+
+def get_store_path() -> str:
+    """
+    Get the path of the SQLite database shared by all worker processes.
+
+    An empty STATE_STORE_PATH falls back to the default, because SQLite would
+    otherwise open a private temporary database on every connection.
+    """
+    return os.getenv("STATE_STORE_PATH") or constants.STATE_STORE_PATH
+
+
+# The store path this process has set up, so set up runs once per worker
+initialised_path = None
+
+
+def initialise() -> None:
+    """
+    Create the shared store if needed, readable only by the current user, with WAL mode and its tables.
+
+    WAL mode is saved in the database file and lets workers read while another
+    writes. This runs once per process, either at startup or on first use.
+    """
+    global initialised_path
+    path = get_store_path()
+    if path == ":memory:" or path.startswith("file:"):
+        raise ValueError(f"STATE_STORE_PATH must be a file path shared by all workers, got '{path}'")
+
+    # Create the file with owner-only permissions before SQLite opens it
+    os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+    os.chmod(path, 0o600)
+
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, profile TEXT, error TEXT, "
+                "worker_pid INTEGER, worker_start_time INTEGER, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            # Stores created before worker start times were recorded
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+            if "worker_start_time" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN worker_start_time INTEGER")
+    finally:
+        connection.close()
+    initialised_path = path
+
+
+@contextlib.contextmanager
+def connect():
+    """
+    Open a connection to the shared store.
+
+    A connection is opened per operation so that it is never shared across
+    forked worker processes.
+    """
+    if initialised_path != get_store_path():
+        initialise()
+
+    connection = sqlite3.connect(initialised_path, timeout=30)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+@contextlib.contextmanager
+def lock(name):
+    """
+    Hold an exclusive lock shared by all worker processes, waiting until it is free.
+
+    The lock is a file next to the shared store, readable only by the current user.
+
+    Parameters:
+    - name (str): The name of the lock.
+    """
+    fd = os.open(f"{get_store_path()}.{name}.lock", os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def get_value(key):
+    """
+    Get a cached value from the shared store.
+
+    Errors reading the store are logged and treated as a cache miss.
+
+    Parameters:
+    - key (str): The cache key.
+
+    Returns:
+    - The cached value, or None if it is missing, has expired or cannot be read.
+    """
+    try:
+        with connect() as connection:
+            row = connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= time.time():
+                connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            return json.loads(value)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"Error reading '{key}' from the shared store: {e}")
+        return None
+
+
+def set_value(key, value, ttl=None) -> None:
+    """
+    Store a value in the shared store.
+
+    Errors writing the store are logged and the value is not cached.
+
+    Parameters:
+    - key (str): The cache key.
+    - value: The JSON serialisable value to store.
+    - ttl (int): The number of seconds the value is valid for (default is no expiry).
+    """
+    expires_at = time.time() + ttl if ttl else None
+    try:
+        with connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            connection.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"Error writing '{key}' to the shared store: {e}")
+
+
+def register_job(job_id, profile) -> bool:
+    """
+    Add a job to the shared job registry with a status of 'running'.
+
+    Jobs last updated longer ago than the retention period are removed first.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    - profile (str): The runtime profile the job uses.
+
+    Returns:
+    - bool: False if a job with the same ID is already registered.
+    """
+    now = time.time()
+    with connect() as connection:
+        connection.execute(
+            "DELETE FROM jobs WHERE updated_at < ?", (now - constants.JOB_RETENTION_SECONDS,)
+        )
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO jobs "
+            "(job_id, status, profile, worker_pid, worker_start_time, created_at, updated_at) "
+            "VALUES (?, 'running', ?, ?, ?, ?, ?)",
+            (job_id, profile, os.getpid(), get_process_start_time(os.getpid()), now, now),
+        )
+        return cursor.rowcount == 1
+
+
+def update_job(job_id, status, error=None) -> None:
+    """
+    Update the status of a job in the shared job registry.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    - status (str): The new status of the job.
+    - error (str): The error the job failed with (default is none).
+    """
+    with connect() as connection:
+        connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+            (status, error, time.time(), job_id),
+        )
+
+
+def get_process_start_time(pid):
+    """
+    Get the time a process started, in clock ticks since boot.
+
+    Together with the process ID this identifies a process even after its ID
+    is reused, for example when the container restarts.
+
+    Parameters:
+    - pid (int): The process ID.
+
+    Returns:
+    - int: The start time, or None if the process does not exist or /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name can contain spaces, so split the fields after it
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def is_process_running(pid, start_time=None) -> bool:
+    """
+    Check whether a process on this host is still running.
+
+    When the start time is known, a process with the same ID but a different
+    start time is a different process, so the original is not running.
+
+    Parameters:
+    - pid (int): The process ID.
+    - start_time (int): The start time returned by get_process_start_time (default is unknown).
+    """
+    if start_time is not None and os.path.isdir("/proc"):
+        return get_process_start_time(pid) == start_time
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def get_job(job_id):
+    """
+    Get a job from the shared job registry.
+
+    A running job whose worker process has exited is marked as failed, since
+    no worker will ever complete it.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+
+    Returns:
+    - dict: The job record, or None if the job is not registered.
+    """
+    with connect() as connection:
+        connection.row_factory = sqlite3.Row
+        row = connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        if job["status"] == "running" and not is_process_running(job["worker_pid"], job["worker_start_time"]):
+            job.update(status="failed", error="The worker handling the job exited before it completed")
+            job["updated_at"] = time.time()
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ? AND status = 'running'",
+                (job["status"], job["error"], job["updated_at"], job_id),
+            )
+        return job